@@ -17,8 +17,16 @@ The "Zero-Impact" Auto-Defender Script (deploy_defender_v3.py)
 
 import boto3
 import logging
+import os
 import datetime
-from botocore.exceptions import ClientError
+import functools
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 # =================CONFIGURATION=================
 
@@ -28,169 +36,259 @@ LAYER_ARNS = {
     'us-west-2': 'arn:aws:lambda:us-west-2:123456789012:layer:twistlock-defender:1',
 }
 
-SUPPORTED_RUNTIMES = [
+SUPPORTED_RUNTIMES = frozenset({
     'python3.8', 'python3.9', 'python3.10', 'python3.11', 'python3.12',
     'nodejs16.x', 'nodejs18.x', 'nodejs20.x'
-]
+})
+
+# Layer ARN substrings that mark a function as already protected
+_PROTECTED_LAYER_MARKERS = ('twistlock', 'prisma')
 
 # --- SAFETY THRESHOLDS ( STRICT ) ---
 MAX_LAYERS = 5
 MIN_MEMORY_MB = 256         # Defender needs ~50MB. <256MB is High Risk.
 TIMEOUT_BUFFER_SEC = 30     # Skip if function takes > (Timeout - 30s)
 MAX_TIMEOUT_SEC = 900
+MAX_SAFE_TIMEOUT_SEC = MAX_TIMEOUT_SEC - TIMEOUT_BUFFER_SEC  # Precomputed for the per-function rule
 CONCURRENCY_BUFFER = 0.80   # Skip if using > 80% of Reserved Concurrency
 THROTTLE_LOOKBACK_HRS = 24  # Check last 24h for ANY throttling events
+CONCURRENCY_PERIOD_SEC = 3600  # Peak ConcurrentExecutions is judged on hourly buckets overlapping the last hour
+METRIC_QUERY_BATCH = 500    # GetMetricData limit of queries per request
+LIST_FUNCTIONS_PAGE_SIZE = 50  # ListFunctions max items per page
+
+# --- SCAN PARALLELISM (I/O bound, threads wait on AWS API calls) ---
+# Env-tunable so very large accounts can raise the in-flight request ceiling
+MAX_FUNCTION_WORKERS = int(os.environ.get('MAX_FUNCTION_WORKERS', '32'))  # Concurrent per-function checks within a region
+MAX_POOL_CONNECTIONS = int(os.environ.get('MAX_POOL_CONNECTIONS', str(2 * MAX_FUNCTION_WORKERS)))  # Per cached client
+
+# Set DRY_RUN=true (env var) to see the audit log without making changes
+_TRUTHY = ('1', 'true', 'yes')
+DRY_RUN = os.environ.get('DRY_RUN', 'true').lower() in _TRUTHY
 
-# Set to True to see the audit log without making changes
-DRY_RUN = True 
+# CloudWatch namespace for the end-of-run report counts (Embedded Metric Format)
+REPORT_METRIC_NAMESPACE = 'PrismaAutoDefender'
+REPORT_DETAIL_CHUNK = 200  # Result entries per detail line; keeps each line well under the CloudWatch Logs event size limit
 
 # ===============================================
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger()
 
+# Shared session/clients: avoids re-loading service models per region and
+# lets region threads share connection pools (session access is serialized).
+_SESSION = boto3.session.Session()
+_CLIENT_CONFIG = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},  # Client-side rate limiting when AWS throttles
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True
+)
+_CLIENT_CACHE = {}
+_CLIENT_LOCK = threading.Lock()
+
+def _client(service, region):
+    """One client per (service, region), reused across threads and calls."""
+    key = (service, region)
+    with _CLIENT_LOCK:
+        if key not in _CLIENT_CACHE:
+            _CLIENT_CACHE[key] = _SESSION.client(service, region_name=region, config=_CLIENT_CONFIG)
+        return _CLIENT_CACHE[key]
+
 def get_clients(region):
     return {
-        'lambda': boto3.client('lambda', region_name=region),
-        'cw': boto3.client('cloudwatch', region_name=region)
+        'lambda': _client('lambda', region),
+        'cw': _client('cloudwatch', region)
     }
 
-def get_metric_sum(cw_client, namespace, metric, dim_name, dim_value, hours=24):
-    """Gets the SUM of a CloudWatch metric for the last X hours."""
-    end_time = datetime.datetime.utcnow()
-    start_time = end_time - datetime.timedelta(hours=hours)
-    
+def _metric_query(query_id, metric, func_name, period, stat):
+    return {
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/Lambda',
+                'MetricName': metric,
+                'Dimensions': [{'Name': 'FunctionName', 'Value': func_name}]
+            },
+            'Period': period,
+            'Stat': stat
+        },
+        'ReturnData': True
+    }
+
+def _fetch_metrics_batch(cw_client, func_names, start_time, end_time):
+    """
+    Throttles (Sum over the window) and ConcurrentExecutions (Maximum over the last hour only)
+    for many functions via GetMetricData, max 500 queries per request.
+    Query Ids are positional (t0/c0, t1/c1...) because function names may contain '-'.
+    Returns: dict of func_name -> {'throttles': x, 'concurrency': y}
+    """
+    queries = []
+    for i, func_name in enumerate(func_names):
+        queries.append(_metric_query(f"t{i}", 'Throttles', func_name, THROTTLE_LOOKBACK_HRS * 3600, 'Sum'))
+        queries.append(_metric_query(f"c{i}", 'ConcurrentExecutions', func_name, CONCURRENCY_PERIOD_SEC, 'Maximum'))
+
+    values = {}
+    paginator = cw_client.get_paginator('get_metric_data')
+    for i in range(0, len(queries), METRIC_QUERY_BATCH):
+        try:
+            for page in paginator.paginate(
+                MetricDataQueries=queries[i:i + METRIC_QUERY_BATCH],
+                StartTime=start_time,
+                EndTime=end_time,
+                ScanBy='TimestampDescending'
+            ):
+                for result in page['MetricDataResults']:
+                    values.setdefault(result['Id'], []).extend(zip(result['Timestamps'], result['Values']))
+        except (ClientError, BotoCoreError) as e:
+            logger.warning(f"  [Metric Check Failed] Could not fetch metrics batch: {e}")
+
+    # CloudWatch omits empty periods, so the newest datapoint can be hours old: only the last hour counts
+    # Timestamps mark the START of each bucket (aligned to StartTime rounded to the minute), so keep
+    # every bucket that overlaps the last hour rather than only those starting inside it
+    last_hour = end_time - datetime.timedelta(hours=1)
+    period = datetime.timedelta(seconds=CONCURRENCY_PERIOD_SEC)
+    metrics = {}
+    for i, func_name in enumerate(func_names):
+        concurrency = [v for ts, v in values.get(f"c{i}", []) if _as_naive_utc(ts) + period > last_hour]
+        metrics[func_name] = {
+            'throttles': sum(v for _, v in values.get(f"t{i}", [])),
+            'concurrency': max(concurrency, default=0)
+        }
+    return metrics
+
+def _as_naive_utc(ts):
+    """botocore returns tz-aware timestamps; the metric window is naive UTC."""
+    if ts.tzinfo is None:
+        return ts
+    return ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+@functools.lru_cache(maxsize=4096)
+def _get_version_config(lambda_client, func_name, ver):
+    """Published versions are immutable, so aliases sharing a version share one lookup."""
+    return lambda_client.get_function_configuration(FunctionName=func_name, Qualifier=ver)
+
+def _list_versioned_aliases(lambda_client, func_name):
+    """Aliases of func_name that point to a published version (not $LATEST)."""
     try:
-        response = cw_client.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric,
-            Dimensions=[{'Name': dim_name, 'Value': dim_value}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=hours * 3600,
-            Statistics=['Sum']
-        )
-        if response['Datapoints']:
-            return response['Datapoints'][0]['Sum']
-        return 0
-    except Exception as e:
-        logger.warning(f"  [Metric Check Failed] Could not fetch {metric}: {e}")
-        return 0
-
-def get_max_concurrency_usage(cw_client, func_name, hours=1):
-    """Gets the MAX ConcurrentExecutions in the last hour."""
-    end_time = datetime.datetime.utcnow()
-    start_time = end_time - datetime.timedelta(hours=hours)
-    
+        aliases = lambda_client.list_aliases(FunctionName=func_name).get('Aliases', [])
+    except (ClientError, BotoCoreError) as e:
+        logger.warning(f"  [Alias Check Failed] {func_name}: {e}")
+        return []
+    # $LATEST is covered by the main scan
+    return [alias for alias in aliases if alias['FunctionVersion'] != '$LATEST']
+
+def _is_version_protected(lambda_client, func_name, ver):
     try:
-        response = cw_client.get_metric_statistics(
-            Namespace='AWS/Lambda',
-            MetricName='ConcurrentExecutions',
-            Dimensions=[{'Name': 'FunctionName', 'Value': func_name}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=3600,
-            Statistics=['Maximum']
-        )
-        if response['Datapoints']:
-            return response['Datapoints'][0]['Maximum']
-        return 0
-    except Exception:
-        return 0
+        return is_protected(_get_version_config(lambda_client, func_name, ver))
+    except (ClientError, BotoCoreError) as e:
+        logger.warning(f"  [Alias Check Failed] {func_name}:{ver}: {e}")
+        return True  # Unknown, do not raise a false alarm
 
-def check_aliases_and_versions(lambda_client, func_name):
+def audit_aliases(lambda_client, func_names):
     """
     Audits if Aliases (PROD, DEV) point to UNPROTECTED versions.
     We cannot fix them (versions are immutable), but we must WARN the user.
+    Runs once after the region scan: aliases are listed concurrently and each
+    distinct (function, version) pair is looked up only once.
     """
-    try:
-        aliases = lambda_client.list_aliases(FunctionName=func_name)
-        for alias in aliases.get('Aliases', []):
-            name = alias['Name']
-            ver = alias['FunctionVersion']
-            
-            # Skip checking $LATEST here, we check it in main logic
-            if ver == '$LATEST': 
-                continue
+    if not func_names:
+        return
+
+    with ThreadPoolExecutor(max_workers=MAX_FUNCTION_WORKERS) as pool:
+        alias_lists = pool.map(lambda name: _list_versioned_aliases(lambda_client, name), func_names)
+
+        aliases_by_version = {}  # (func_name, version) -> [alias names]
+        for func_name, aliases in zip(func_names, alias_lists):
+            for alias in aliases:
+                aliases_by_version.setdefault((func_name, alias['FunctionVersion']), []).append(alias['Name'])
 
-            # Check specific version config
-            ver_config = lambda_client.get_function_configuration(FunctionName=func_name, Qualifier=ver)
-            if not is_protected(ver_config):
-                logger.warning(f"  ⚠️  [ALIAS RISK] Alias '{name}' points to UNPROTECTED version {ver}. Deployment will NOT protect live traffic on this alias.")
-    except Exception as e:
-        logger.warning(f"  [Alias Check Failed] {e}")
+        versions = list(aliases_by_version)
+        protected = pool.map(lambda key: _is_version_protected(lambda_client, *key), versions)
+
+        for (func_name, ver), is_ver_protected in zip(versions, protected):
+            if is_ver_protected:
+                continue
+            for name in aliases_by_version[(func_name, ver)]:
+                logger.warning(f"  ⚠️  [ALIAS RISK] {func_name}: Alias '{name}' points to UNPROTECTED version {ver}. Deployment will NOT protect live traffic on this alias.")
 
 def is_protected(function_config):
-    layers = function_config.get('Layers', [])
-    for layer in layers:
-        if 'twistlock' in layer['Arn'] or 'prisma' in layer['Arn']:
-            return True
-    env = function_config.get('Environment', {}).get('Variables', {})
-    return 'TW_POLICY' in env
-
-def assess_risk_deep(clients, function_config):
-    """
-    DEEP INSPECTION MODE
-    Returns: (Boolean is_safe, String reason)
-    """
-    l_client = clients['lambda']
-    cw_client = clients['cw']
-    func_name = function_config['FunctionName']
-    
+    layers = function_config.get('Layers') or ()
+    if any(marker in layer['Arn'] for layer in layers for marker in _PROTECTED_LAYER_MARKERS):
+        return True
+    env = function_config.get('Environment') or {}
+    return 'TW_POLICY' in (env.get('Variables') or ())
+
+# Cheap checks on the list_functions payload, in order: (predicate, reason)
+_CONFIG_RULES = [
     # --- 1. IMMUTABLE CHECKS ---
-    if function_config.get('PackageType') == 'Image':
-        return False, "Deployed as Container Image (Requires Dockerfile embedding)"
-        
-    architectures = function_config.get('Architectures', ['x86_64'])
-    if 'arm64' in architectures:
-        return False, "ARM64 Architecture (Not supported by current Defender Layer)"
-
-    runtime = function_config.get('Runtime', '')
-    if runtime not in SUPPORTED_RUNTIMES:
-        return False, f"Unsupported Runtime ({runtime})"
+    (lambda c: c.get('PackageType') == 'Image',
+     lambda c: "Deployed as Container Image (Requires Dockerfile embedding)"),
+    (lambda c: 'arm64' in c.get('Architectures', ['x86_64']),
+     lambda c: "ARM64 Architecture (Not supported by current Defender Layer)"),
+    (lambda c: c.get('Runtime', '') not in SUPPORTED_RUNTIMES,
+     lambda c: f"Unsupported Runtime ({c.get('Runtime', '')})"),
 
     # --- 2. CONFIGURATION CHECKS ---
-    memory = function_config.get('MemorySize', 128)
-    if memory < MIN_MEMORY_MB:
-        return False, f"Low Memory ({memory}MB). Risk of OOM with Defender overhead."
+    (lambda c: c.get('MemorySize', 128) < MIN_MEMORY_MB,
+     lambda c: f"Low Memory ({c.get('MemorySize', 128)}MB). Risk of OOM with Defender overhead."),
+    (lambda c: c.get('Timeout', 3) > MAX_SAFE_TIMEOUT_SEC,
+     lambda c: f"Timeout ({c.get('Timeout', 3)}s) too close to 15min limit."),
+    (lambda c: len(c.get('Layers', [])) >= MAX_LAYERS,
+     lambda c: "Max Layers Reached"),
+]
+
+def assess_config_risk(function_config):
+    """
+    CHEAP CHECKS - evaluates _CONFIG_RULES against the list_functions payload, no API calls.
+    Run before any metric/API lookups so skipped functions cost nothing.
+    Returns: (Boolean is_safe, String reason)
+    """
+    for predicate, reason in _CONFIG_RULES:
+        if predicate(function_config):
+            return False, reason(function_config)
 
-    timeout = function_config.get('Timeout', 3)
-    if timeout > (MAX_TIMEOUT_SEC - TIMEOUT_BUFFER_SEC):
-        return False, f"Timeout ({timeout}s) too close to 15min limit."
+    return True, "Safe"
 
-    if len(function_config.get('Layers', [])) >= MAX_LAYERS:
-        return False, "Max Layers Reached"
+def assess_risk_deep(clients, function_config, throttles=0, peak_concurrency=0):
+    """
+    DEEP INSPECTION MODE (for functions that passed assess_config_risk)
+    Metrics are pre-fetched in bulk by process_region (see _fetch_metrics_batch).
+    Returns: (Boolean is_safe, String reason)
+    """
+    l_client = clients['lambda']
+    func_name = function_config['FunctionName']
 
-    # --- 3. PROVISIONED CONCURRENCY CHECK ---
-    # Changing layers on Provisioned functions triggers expensive re-provisioning
-    try:
-        pc = l_client.list_provisioned_concurrency_configs(FunctionName=func_name)
-        if pc.get('ProvisionedConcurrencyConfigs'):
-            return False, "Function has Provisioned Concurrency (Modification triggers re-warming costs)"
-    except:
-        pass # Ignore permission errors, assume none
-
-    # --- 4. CLOUDWATCH METRICS: THROTTLING ---
-    throttles = get_metric_sum(cw_client, 'AWS/Lambda', 'Throttles', 'FunctionName', func_name, hours=THROTTLE_LOOKBACK_HRS)
+    # --- 3. CLOUDWATCH METRICS: THROTTLING ---
     if throttles > 0:
         return False, f"UNSTABLE: {int(throttles)} Throttles detected in last {THROTTLE_LOOKBACK_HRS}h. Do not touch."
 
+    # --- 4. PROVISIONED CONCURRENCY CHECK ---
+    # Changing layers on Provisioned functions triggers expensive re-provisioning.
+    # list_functions omits State, so only explicitly non-Active functions skip the call.
+    if function_config.get('State', 'Active') == 'Active':
+        try:
+            pc = l_client.list_provisioned_concurrency_configs(FunctionName=func_name)
+            if pc.get('ProvisionedConcurrencyConfigs'):
+                return False, "Function has Provisioned Concurrency (Modification triggers re-warming costs)"
+        except (ClientError, BotoCoreError) as e:
+            logger.debug(f"  [Provisioned Concurrency Check Skipped] {func_name}: {e}")  # e.g. permissions, assume none
+
     # --- 5. CLOUDWATCH METRICS: CONCURRENCY SATURATION ---
-    # If Reserved Concurrency is set, ensure we aren't already near the limit
-    try:
-        concurrency_config = l_client.get_function_concurrency(FunctionName=func_name)
-        reserved = concurrency_config.get('ReservedConcurrentExecutions')
-        
-        if reserved:
-            used = get_max_concurrency_usage(cw_client, func_name)
-            if used > (reserved * CONCURRENCY_BUFFER):
-                return False, f"High Concurrency Usage ({used}/{reserved}). Adding latency risk."
-    except:
-        pass # No reserved concurrency set
+    # If Reserved Concurrency is set, ensure we aren't already near the limit.
+    # No recent executions means no saturation, so skip the lookup.
+    if peak_concurrency > 0:
+        try:
+            concurrency_config = l_client.get_function_concurrency(FunctionName=func_name)
+            reserved = concurrency_config.get('ReservedConcurrentExecutions')
+
+            if reserved and peak_concurrency > (reserved * CONCURRENCY_BUFFER):
+                return False, f"High Concurrency Usage ({peak_concurrency}/{reserved}). Adding latency risk."
+        except (ClientError, BotoCoreError) as e:
+            logger.debug(f"  [Reserved Concurrency Check Skipped] {func_name}: {e}")
 
     return True, "Safe"
 
 def deploy_defender(client, function_config, layer_arn):
+    """Returns: (Boolean is_protected, String detail)"""
     func_name = function_config['FunctionName']
     current_layers = [l['Arn'] for l in function_config.get('Layers', [])]
     new_layers = current_layers + [layer_arn]
@@ -201,8 +299,7 @@ def deploy_defender(client, function_config, layer_arn):
     new_env['AWS_LAMBDA_EXEC_WRAPPER'] = '/opt/twistlock/wrapper.sh'
 
     if DRY_RUN:
-        logger.info(f"✅ [DRY RUN] Would PROTECT {func_name}")
-        return
+        return True, "Dry run (would protect)"
 
     try:
         client.update_function_configuration(
@@ -210,44 +307,146 @@ def deploy_defender(client, function_config, layer_arn):
             Layers=new_layers,
             Environment={'Variables': new_env}
         )
-        logger.info(f"🚀 PROTECTED: {func_name}")
-    except ClientError as e:
+        return True, "Protected"
+    except (ClientError, BotoCoreError) as e:
         logger.error(f"❌ AWS Update Failed: {e}")
+        return False, str(e)
 
 def process_region(region):
-    if region not in LAYER_ARNS: return
+    """Returns: list of {'func', 'action' ('protect'|'skip'|'error'), 'reason'} for unprotected functions"""
+    layer_arn = LAYER_ARNS.get(region)
+    if layer_arn is None: return []
 
     logger.info(f"--- Scanning Region: {region} ---")
+    # One metric window for the whole region scan
+    end_time = datetime.datetime.utcnow()
+    start_time = end_time - datetime.timedelta(hours=THROTTLE_LOOKBACK_HRS)
+
     clients = get_clients(region)
-    layer_arn = LAYER_ARNS[region]
     
     paginator = clients['lambda'].get_paginator('list_functions')
-    
-    for page in paginator.paginate():
+
+    # 1. Status + cheap config checks (collect candidates so metrics can be fetched in bulk)
+    results = []
+    candidates = []
+    for page in paginator.paginate(PaginationConfig={'PageSize': LIST_FUNCTIONS_PAGE_SIZE}):
         for func in page['Functions']:
-            func_name = func['FunctionName']
-            
-            # 1. Status Check
             if is_protected(func):
                 continue
-            
-            # 2. Deep Risk Assessment
-            is_safe, reason = assess_risk_deep(clients, func)
-            
-            # 3. Alias Audit (Informational only)
-            check_aliases_and_versions(clients['lambda'], func_name)
 
+            is_safe, reason = assess_config_risk(func)
             if is_safe:
-                deploy_defender(clients['lambda'], func, layer_arn)
+                candidates.append(func)
             else:
-                logger.warning(f"🚫 SKIPPED {func_name}: {reason}")
+                results.append({'func': func['FunctionName'], 'action': 'skip', 'reason': reason})
+
+    if not candidates:
+        return results
+
+    # 2. Batched CloudWatch lookup (one GetMetricData call per 500 queries)
+    metrics = _fetch_metrics_batch(clients['cw'], [f['FunctionName'] for f in candidates], start_time, end_time)
+
+    # 3. Per-function checks run concurrently
+    with ThreadPoolExecutor(max_workers=MAX_FUNCTION_WORKERS) as pool:
+        futures = []
+        for func in candidates:
+            func_metrics = metrics[func['FunctionName']]
+            futures.append(pool.submit(
+                protect_if_safe, clients, func, layer_arn,
+                func_metrics['throttles'], func_metrics['concurrency']
+            ))
+
+        # An unexpected error on one function must not drop the entries of updates already applied
+        for func, future in zip(candidates, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"❌ Check failed for {func['FunctionName']}: {e}")
+                results.append({'func': func['FunctionName'], 'action': 'error', 'reason': str(e)})
+
+    # 4. Alias Audit (Informational only, relevant once $LATEST gets protected)
+    audit_aliases(clients['lambda'], [r['func'] for r in results if r['action'] == 'protect'])
+
+    return results
+
+def protect_if_safe(clients, func, layer_arn, throttles, peak_concurrency):
+    """Returns: report entry for the function (see process_region)"""
+    func_name = func['FunctionName']
+
+    # Deep Risk Assessment
+    is_safe, reason = assess_risk_deep(clients, func, throttles, peak_concurrency)
+    if not is_safe:
+        return {'func': func_name, 'action': 'skip', 'reason': reason}
+
+    is_protected_now, detail = deploy_defender(clients['lambda'], func, layer_arn)
+    return {'func': func_name, 'action': 'protect' if is_protected_now else 'error', 'reason': detail}
+
+def emit_report(results_by_region, failed_regions=()):
+    """
+    Emits the run summary as ONE small line in CloudWatch Embedded Metric Format (so the counts
+    also become metrics), followed by the per-function results in chunked lines per region.
+    """
+    mode = 'DryRun' if DRY_RUN else 'Apply'
+    counts = Counter(r['action'] for results in results_by_region.values() for r in results)
+    summary = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': REPORT_METRIC_NAMESPACE,
+                'Dimensions': [['Mode']],
+                'Metrics': [
+                    {'Name': 'Protected', 'Unit': 'Count'},
+                    {'Name': 'Skipped', 'Unit': 'Count'},
+                    {'Name': 'Failed', 'Unit': 'Count'}
+                ]
+            }]
+        },
+        'Mode': mode,
+        'Protected': counts['protect'],
+        'Skipped': counts['skip'],
+        'Failed': counts['error'],
+        'FailedRegions': list(failed_regions)
+    }
+    # EMF is parsed from the raw log line, so bypass the logger's level prefix
+    print(json.dumps(summary))
+
+    for region, results in results_by_region.items():
+        for i in range(0, len(results), REPORT_DETAIL_CHUNK):
+            print(json.dumps({'Mode': mode, 'Region': region, 'Results': results[i:i + REPORT_DETAIL_CHUNK]}))
 
 def main():
-    for region in LAYER_ARNS.keys():
-        process_region(region)
+    # One thread per region; each region fans out its own function checks
+    results_by_region = {}
+    failed_regions = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(LAYER_ARNS)) as pool:
+            futures = {pool.submit(process_region, region): region for region in LAYER_ARNS}
+            for future in as_completed(futures):
+                region = futures[future]
+                try:
+                    results_by_region[region] = future.result()
+                except Exception as e:
+                    logger.error(f"❌ Scan failed in {region}: {e}")
+                    failed_regions.append(region)
+    finally:
+        # The report is the audit trail of what changed, so it goes out even if the run dies
+        emit_report(results_by_region, failed_regions)
+
+    # Let the other regions finish, then fail the run so the error is not lost
+    if failed_regions:
+        raise RuntimeError(f"Scan failed in regions: {', '.join(failed_regions)}")
 
 def lambda_handler(event, context):
-    main()
+    # Per-invocation override: {"dry_run": true|false}. Restored afterwards
+    # so a warm container falls back to the DRY_RUN env setting.
+    global DRY_RUN
+    default_dry_run = DRY_RUN
+    if event and 'dry_run' in event:
+        DRY_RUN = str(event['dry_run']).lower() in _TRUTHY
+    try:
+        main()
+    finally:
+        DRY_RUN = default_dry_run
 
 if __name__ == '__main__':
     main()
@@ -277,7 +476,7 @@ Logic: The script enforces a strict 256MB floor. (Standard Defender requirement
 
 "What about my PROD alias?"
 
-Check: check_aliases_and_versions
+Check: audit_aliases
 
 Logic: It iterates through all aliases. If PROD points to Version 5, and Version 5 does not have the layer, it logs a [ALIAS RISK] warning. This tells you that "Protecting $LATEST is not enough, you need to re-deploy your pipeline."
 
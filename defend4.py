@@ -34,9 +34,15 @@ Fix: Skip any function where SnapStart is enabled.
 
 import boto3
 import logging
+import os
 import json
 import datetime
-from botocore.exceptions import ClientError
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 # ================= CONFIGURATION =================
 # Region Map (Update with your specific Layer ARNs)
@@ -44,94 +50,158 @@ LAYER_ARNS = {
     'us-east-1': 'arn:aws:lambda:us-east-1:123456789012:layer:twistlock-defender:1',
 }
 
-SUPPORTED_RUNTIMES = [
+SUPPORTED_RUNTIMES = frozenset({
     'python3.8', 'python3.9', 'python3.10', 'python3.11', 'python3.12',
     'nodejs16.x', 'nodejs18.x', 'nodejs20.x'
-]
+})
+
+# Layer ARN substrings that mark a function as already protected
+_PROTECTED_LAYER_MARKERS = ('twistlock', 'prisma')
 
 # --- SAFETY THRESHOLDS ---
+MAX_LAYERS = 5
 MIN_MEMORY_MB = 256
 MAX_ENV_VAR_SIZE_BYTES = 4096  # AWS Hard Limit
 TIMEOUT_BUFFER_SEC = 30
 MAX_TIMEOUT_SEC = 900
+MAX_SAFE_TIMEOUT_SEC = MAX_TIMEOUT_SEC - TIMEOUT_BUFFER_SEC
 THROTTLE_LOOKBACK_HRS = 24
+METRIC_QUERY_BATCH = 500  # GetMetricData limit of queries per request
+LIST_FUNCTIONS_PAGE_SIZE = 50  # ListFunctions max items per page
+
+# --- SCAN PARALLELISM ---
+# Env-tunable so very large accounts can raise the in-flight request ceiling
+MAX_FUNCTION_WORKERS = int(os.environ.get('MAX_FUNCTION_WORKERS', '32'))  # Concurrent per-function checks within a region
+MAX_POOL_CONNECTIONS = int(os.environ.get('MAX_POOL_CONNECTIONS', str(2 * MAX_FUNCTION_WORKERS)))  # Per cached client
+
+# DRY_RUN env var: true to AUDIT only, false to APPLY changes.
+_TRUTHY = ('1', 'true', 'yes')
+DRY_RUN = os.environ.get('DRY_RUN', 'true').lower() in _TRUTHY
 
-# Set True to AUDIT only. Set False to APPLY changes.
-DRY_RUN = True 
+# CloudWatch namespace for the end-of-run report counts (Embedded Metric Format)
+REPORT_METRIC_NAMESPACE = 'PrismaAutoDefender'
+REPORT_DETAIL_CHUNK = 200  # Result entries per detail line; keeps each line well under the CloudWatch Logs event size limit
 # ===============================================
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger()
 
+# Shared session/clients: avoids re-loading service models per region and
+# lets region threads share connection pools (session access is serialized).
+_SESSION = boto3.session.Session()
+_CLIENT_CONFIG = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},  # Client-side rate limiting when AWS throttles
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True
+)
+_CLIENT_CACHE = {}
+_CLIENT_LOCK = threading.Lock()
+
+def _client(service, region):
+    """One client per (service, region), reused across threads and calls."""
+    key = (service, region)
+    with _CLIENT_LOCK:
+        if key not in _CLIENT_CACHE:
+            _CLIENT_CACHE[key] = _SESSION.client(service, region_name=region, config=_CLIENT_CONFIG)
+        return _CLIENT_CACHE[key]
+
 def get_clients(region):
     return {
-        'lambda': boto3.client('lambda', region_name=region),
-        'cw': boto3.client('cloudwatch', region_name=region)
+        'lambda': _client('lambda', region),
+        'cw': _client('cloudwatch', region)
     }
 
 def calculate_env_size(env_vars):
-    """Calculates the total size of environment variables in bytes."""
-    size = 0
-    for k, v in env_vars.items():
-        size += len(str(k)) + len(str(v))
-    return size
+    """Calculates the total size of environment variables in bytes (UTF-8, as AWS counts them)."""
+    return sum(len(k.encode('utf-8')) + len(v.encode('utf-8')) for k, v in env_vars.items())
 
 def is_protected(function_config):
-    layers = function_config.get('Layers', [])
-    for layer in layers:
-        if 'twistlock' in layer['Arn'] or 'prisma' in layer['Arn']:
-            return True
-    env = function_config.get('Environment', {}).get('Variables', {})
-    return 'TW_POLICY' in env
-
-def check_throttling(cw_client, func_name):
-    """Checks for ANY throttling in the last 24 hours."""
-    end_time = datetime.datetime.utcnow()
-    start_time = end_time - datetime.timedelta(hours=THROTTLE_LOOKBACK_HRS)
-    try:
-        resp = cw_client.get_metric_statistics(
-            Namespace='AWS/Lambda', MetricName='Throttles',
-            Dimensions=[{'Name': 'FunctionName', 'Value': func_name}],
-            StartTime=start_time, EndTime=end_time, Period=86400, Statistics=['Sum']
-        )
-        if resp['Datapoints'] and resp['Datapoints'][0]['Sum'] > 0:
-            return True
-    except:
-        pass
-    return False
+    layers = function_config.get('Layers') or ()
+    if any(marker in layer['Arn'] for layer in layers for marker in _PROTECTED_LAYER_MARKERS):
+        return True
+    env = function_config.get('Environment') or {}
+    return 'TW_POLICY' in (env.get('Variables') or ())
 
-def assess_risk_deep_dive(clients, function_config):
+def get_throttle_counts(cw_client, func_names, start_time, end_time):
     """
-    Performs rigorous checks against AWS Limitations.
+    Fetches Throttles in [start_time, end_time] for many functions via GetMetricData (500 queries per call).
+    Returns: dict of func_name -> throttle count
     """
-    func_name = function_config['FunctionName']
-    
-    # 1. HARDWARE & RUNTIME (Basic Checks)
-    if function_config.get('PackageType') == 'Image':
-        return False, "Skipping: Container Image (Requires Dockerfile embedding)"
-    
-    if 'arm64' in function_config.get('Architectures', ['x86_64']):
-        return False, "Skipping: ARM64 Architecture not supported"
-        
-    if function_config.get('Runtime') not in SUPPORTED_RUNTIMES:
-        return False, "Skipping: Unsupported Runtime"
+    queries = [
+        {
+            'Id': f"t{i}",
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': 'AWS/Lambda', 'MetricName': 'Throttles',
+                    'Dimensions': [{'Name': 'FunctionName', 'Value': func_name}]
+                },
+                'Period': 86400, 'Stat': 'Sum'
+            }
+        }
+        for i, func_name in enumerate(func_names)
+    ]
+
+    by_id = {}
+    paginator = cw_client.get_paginator('get_metric_data')
+    for i in range(0, len(queries), METRIC_QUERY_BATCH):
+        try:
+            for page in paginator.paginate(
+                MetricDataQueries=queries[i:i + METRIC_QUERY_BATCH],
+                StartTime=start_time, EndTime=end_time
+            ):
+                for result in page['MetricDataResults']:
+                    by_id[result['Id']] = by_id.get(result['Id'], 0) + sum(result['Values'])
+        except (ClientError, BotoCoreError) as e:
+            logger.debug(f"  [Throttle Check Failed] Could not fetch metrics batch: {e}")
+
+    return {func_name: by_id.get(f"t{i}", 0) for i, func_name in enumerate(func_names)}
+
+# Basic checks on the list_functions payload, in order: (predicate, reason)
+_CONFIG_RULES = [
+    # 1. HARDWARE & RUNTIME
+    (lambda c: c.get('PackageType') == 'Image', "Skipping: Container Image (Requires Dockerfile embedding)"),
+    (lambda c: 'arm64' in c.get('Architectures', ['x86_64']), "Skipping: ARM64 Architecture not supported"),
+    (lambda c: c.get('Runtime') not in SUPPORTED_RUNTIMES, "Skipping: Unsupported Runtime"),
 
     # 2. STABILITY (Memory/Timeout)
-    if function_config.get('MemorySize', 128) < MIN_MEMORY_MB:
-        return False, f"Risk: Low Memory (<{MIN_MEMORY_MB}MB). Risk of OOM."
+    (lambda c: c.get('MemorySize', 128) < MIN_MEMORY_MB, f"Risk: Low Memory (<{MIN_MEMORY_MB}MB). Risk of OOM."),
+    (lambda c: c.get('Timeout', 3) > MAX_SAFE_TIMEOUT_SEC, "Risk: Timeout too close to 15min limit."),
+    (lambda c: len(c.get('Layers', [])) >= MAX_LAYERS, f"Skipping: Max Layers ({MAX_LAYERS}) reached."),
+]
 
-    timeout = function_config.get('Timeout', 3)
-    if timeout > (MAX_TIMEOUT_SEC - TIMEOUT_BUFFER_SEC):
-        return False, "Risk: Timeout too close to 15min limit."
+def assess_config_risk(function_config):
+    """
+    Evaluates _CONFIG_RULES without any API call; process_region runs this
+    before fetching metrics so skipped functions are never queried.
+    """
+    for predicate, reason in _CONFIG_RULES:
+        if predicate(function_config):
+            return False, reason
+    return True, "Safe"
 
-    # 3. ENVIRONMENT VARIABLE QUOTA (The 4KB Trap)
+def build_defender_env(function_config):
+    """Existing env vars merged with the Prisma specific ones (TW_POLICY, exec wrapper)."""
     current_env = function_config.get('Environment', {}).get('Variables', {})
-    # Estimate size of NEW variables we will add
-    new_vars_size = len("TW_POLICY") + len(func_name) + len("AWS_LAMBDA_EXEC_WRAPPER") + len("/opt/twistlock/wrapper.sh")
-    total_size = calculate_env_size(current_env) + new_vars_size
+    new_env = current_env.copy()
+    new_env['TW_POLICY'] = function_config['FunctionName']
+    new_env['AWS_LAMBDA_EXEC_WRAPPER'] = '/opt/twistlock/wrapper.sh'
+    return new_env
+
+def assess_risk_deep_dive(clients, function_config, throttles=0):
+    """
+    Performs rigorous checks against AWS Limitations.
+    Expects functions that passed assess_config_risk; throttle counts are pre-fetched in bulk.
+    Returns: (Boolean is_safe, String reason, Dict new_env if safe else None)
+    """
+    func_name = function_config['FunctionName']
+    
+    # 3. ENVIRONMENT VARIABLE QUOTA (The 4KB Trap)
+    # Size the exact env that deploy_defender will apply
+    new_env = build_defender_env(function_config)
+    total_size = calculate_env_size(new_env)
     
     if total_size >= MAX_ENV_VAR_SIZE_BYTES:
-        return False, f"CRITICAL: Env Vars too full ({total_size}/{MAX_ENV_VAR_SIZE_BYTES} bytes). Adding Defender will crash deployment."
+        return False, f"CRITICAL: Env Vars too full ({total_size}/{MAX_ENV_VAR_SIZE_BYTES} bytes). Adding Defender will crash deployment.", None
 
     # 4. VPC & CONNECTIVITY (The Black Hole)
     vpc_config = function_config.get('VpcConfig', {})
@@ -145,34 +215,28 @@ def assess_risk_deep_dive(clients, function_config):
 
     # 5. SNAPSTART (Java/Future Python)
     if function_config.get('SnapStart', {}).get('ApplyOn') != 'None':
-        return False, "Skipping: SnapStart enabled. Modifying layers requires complex version publishing."
+        return False, "Skipping: SnapStart enabled. Modifying layers requires complex version publishing.", None
 
     # 6. THROTTLING HISTORY
-    if check_throttling(clients['cw'], func_name):
-        return False, "Risk: Function was throttled in last 24h. Too unstable to modify."
+    if throttles > 0:
+        return False, "Risk: Function was throttled in last 24h. Too unstable to modify.", None
 
-    return True, "Safe"
+    return True, "Safe", new_env
 
-def deploy_defender(client, function_config, layer_arn):
+def deploy_defender(client, function_config, layer_arn, new_env):
+    """
+    Expects functions that passed assess_config_risk (which enforces MAX_LAYERS),
+    and the new_env that assess_risk_deep_dive sized against the 4KB quota.
+    Returns: (Boolean is_protected, String detail)
+    """
     func_name = function_config['FunctionName']
     
     # Logic to merge layers
     current_layers = [l['Arn'] for l in function_config.get('Layers', [])]
-    if len(current_layers) >= 5:
-        logger.warning(f"🚫 SKIPPED {func_name}: Max Layers (5) reached.")
-        return
-
     new_layers = current_layers + [layer_arn]
-    
-    # Logic to merge Env Vars
-    current_env = function_config.get('Environment', {}).get('Variables', {})
-    new_env = current_env.copy()
-    new_env['TW_POLICY'] = func_name
-    new_env['AWS_LAMBDA_EXEC_WRAPPER'] = '/opt/twistlock/wrapper.sh'
 
     if DRY_RUN:
-        logger.info(f"✅ [DRY RUN] Would PROTECT {func_name}")
-        return
+        return True, "Dry run (would protect)"
 
     try:
         client.update_function_configuration(
@@ -180,39 +244,132 @@ def deploy_defender(client, function_config, layer_arn):
             Layers=new_layers,
             Environment={'Variables': new_env}
         )
-        logger.info(f"🚀 PROTECTED: {func_name}")
-    except ClientError as e:
+        return True, "Protected"
+    except (ClientError, BotoCoreError) as e:
         logger.error(f"❌ Failed to update {func_name}: {e}")
+        return False, str(e)
 
 def process_region(region):
-    if region not in LAYER_ARNS: return
+    """Returns: list of {'func', 'action' ('protect'|'skip'|'error'), 'reason'} for unprotected functions"""
+    layer_arn = LAYER_ARNS.get(region)
+    if layer_arn is None: return []
 
     logger.info(f"--- Scanning Region: {region} ---")
+    # One throttle window for the whole region scan
+    end_time = datetime.datetime.utcnow()
+    start_time = end_time - datetime.timedelta(hours=THROTTLE_LOOKBACK_HRS)
+
     clients = get_clients(region)
-    layer_arn = LAYER_ARNS[region]
     
     paginator = clients['lambda'].get_paginator('list_functions')
-    
-    for page in paginator.paginate():
+
+    results = []
+    candidates = []
+    for page in paginator.paginate(PaginationConfig={'PageSize': LIST_FUNCTIONS_PAGE_SIZE}):
         for func in page['Functions']:
-            func_name = func['FunctionName']
-            
             if is_protected(func):
                 continue
-            
-            is_safe, reason = assess_risk_deep_dive(clients, func)
-            
+
+            is_safe, reason = assess_config_risk(func)
             if is_safe:
-                deploy_defender(clients['lambda'], func, layer_arn)
+                candidates.append(func)
             else:
-                logger.warning(f"🚫 SKIPPED {func_name}: {reason}")
+                results.append({'func': func['FunctionName'], 'action': 'skip', 'reason': reason})
+
+    throttle_counts = get_throttle_counts(clients['cw'], [f['FunctionName'] for f in candidates], start_time, end_time)
+
+    with ThreadPoolExecutor(max_workers=MAX_FUNCTION_WORKERS) as pool:
+        futures = [
+            pool.submit(protect_if_safe, clients, func, layer_arn, throttle_counts[func['FunctionName']])
+            for func in candidates
+        ]
+        # An unexpected error on one function must not drop the entries of updates already applied
+        for func, future in zip(candidates, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"❌ Check failed for {func['FunctionName']}: {e}")
+                results.append({'func': func['FunctionName'], 'action': 'error', 'reason': str(e)})
+
+    return results
+
+def protect_if_safe(clients, func, layer_arn, throttles):
+    """Returns: report entry for the function (see process_region)"""
+    func_name = func['FunctionName']
+
+    is_safe, reason, new_env = assess_risk_deep_dive(clients, func, throttles)
+    if not is_safe:
+        return {'func': func_name, 'action': 'skip', 'reason': reason}
+
+    is_protected_now, detail = deploy_defender(clients['lambda'], func, layer_arn, new_env)
+    return {'func': func_name, 'action': 'protect' if is_protected_now else 'error', 'reason': detail}
+
+def emit_report(results_by_region, failed_regions=()):
+    """
+    Emits the run summary as ONE small line in CloudWatch Embedded Metric Format (so the counts
+    also become metrics), followed by the per-function results in chunked lines per region.
+    """
+    mode = 'DryRun' if DRY_RUN else 'Apply'
+    counts = Counter(r['action'] for results in results_by_region.values() for r in results)
+    summary = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': REPORT_METRIC_NAMESPACE,
+                'Dimensions': [['Mode']],
+                'Metrics': [
+                    {'Name': 'Protected', 'Unit': 'Count'},
+                    {'Name': 'Skipped', 'Unit': 'Count'},
+                    {'Name': 'Failed', 'Unit': 'Count'}
+                ]
+            }]
+        },
+        'Mode': mode,
+        'Protected': counts['protect'],
+        'Skipped': counts['skip'],
+        'Failed': counts['error'],
+        'FailedRegions': list(failed_regions)
+    }
+    # EMF is parsed from the raw log line, so bypass the logger's level prefix
+    print(json.dumps(summary))
+
+    for region, results in results_by_region.items():
+        for i in range(0, len(results), REPORT_DETAIL_CHUNK):
+            print(json.dumps({'Mode': mode, 'Region': region, 'Results': results[i:i + REPORT_DETAIL_CHUNK]}))
 
 def main():
-    for region in LAYER_ARNS.keys():
-        process_region(region)
+    # One thread per region; each region fans out its own function checks
+    results_by_region = {}
+    failed_regions = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(LAYER_ARNS)) as pool:
+            futures = {pool.submit(process_region, region): region for region in LAYER_ARNS}
+            for future in as_completed(futures):
+                region = futures[future]
+                try:
+                    results_by_region[region] = future.result()
+                except Exception as e:
+                    logger.error(f"❌ Scan failed in {region}: {e}")
+                    failed_regions.append(region)
+    finally:
+        # The report is the audit trail of what changed, so it goes out even if the run dies
+        emit_report(results_by_region, failed_regions)
+
+    # Let the other regions finish, then fail the run so the error is not lost
+    if failed_regions:
+        raise RuntimeError(f"Scan failed in regions: {', '.join(failed_regions)}")
 
 def lambda_handler(event, context):
-    main()
+    # Per-invocation override: {"dry_run": true|false}. Restored afterwards
+    # so a warm container falls back to the DRY_RUN env setting.
+    global DRY_RUN
+    default_dry_run = DRY_RUN
+    if event and 'dry_run' in event:
+        DRY_RUN = str(event['dry_run']).lower() in _TRUTHY
+    try:
+        main()
+    finally:
+        DRY_RUN = default_dry_run
 
 if __name__ == '__main__':
     main()
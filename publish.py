@@ -15,7 +15,10 @@ import requests
 import json
 import os
 import zipfile
-import io
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 
 # ================= CONFIGURATION =================
 PRISMA_CONSOLE_URL = "https://your-console.twistlock.com" # No trailing slash
@@ -25,6 +28,9 @@ PRISMA_PASS = os.environ.get('PCC_PASS')      # Export these in your terminal
 # Target Regions to publish the layer to
 TARGET_REGIONS = ['us-east-1', 'us-west-2', 'eu-central-1']
 
+# Bundles larger than this are spooled to disk while downloading
+BUNDLE_SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
 # Runtimes this layer supports (Prisma Universal Layer usually supports all)
 COMPATIBLE_RUNTIMES = [
     'python3.8', 'python3.9', 'python3.10', 'python3.11', 'python3.12',
@@ -32,6 +38,9 @@ COMPATIBLE_RUNTIMES = [
 ]
 # =================================================
 
+# Adaptive retries back off when AWS throttles; keep-alive reuses connections
+_CLIENT_CONFIG = Config(retries={'max_attempts': 10, 'mode': 'adaptive'}, tcp_keepalive=True)
+
 def get_auth_token():
     url = f"{PRISMA_CONSOLE_URL}/api/v1/authenticate"
     payload = {"username": PRISMA_USER, "password": PRISMA_PASS}
@@ -61,42 +70,55 @@ def download_defender_layer(token):
         
         # The API returns a bundle.zip which CONTAINS the layer.zip
         # We need to extract 'twistlock_defender_layer.zip' from it
-        with zipfile.ZipFile(io.BytesIO(resp.content)) as bundle:
-            # List files to find the layer zip
-            for filename in bundle.namelist():
-                if "twistlock_defender_layer.zip" in filename:
-                    return bundle.read(filename)
-            
-            print("❌ Could not find 'twistlock_defender_layer.zip' inside the bundle.")
-            print(f"Contents: {bundle.namelist()}")
-            exit(1)
+        # Stream the bundle into a spooled temp file (spills to disk past the limit)
+        # instead of buffering the whole response in memory via resp.content
+        with tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_MAX_BYTES) as tmp:
+            resp.raw.decode_content = True
+            shutil.copyfileobj(resp.raw, tmp)
+            tmp.seek(0)
+
+            with zipfile.ZipFile(tmp) as bundle:
+                # List files to find the layer zip
+                for filename in bundle.namelist():
+                    if "twistlock_defender_layer.zip" in filename:
+                        with bundle.open(filename) as layer_zip:
+                            return layer_zip.read()
+                
+                print("❌ Could not find 'twistlock_defender_layer.zip' inside the bundle.")
+                print(f"Contents: {bundle.namelist()}")
+                exit(1)
             
     except Exception as e:
         print(f"❌ Download Failed: {e}")
         exit(1)
 
+def publish_to_region(layer_content, region):
+    print(f"   --- Publishing to {region} ---")
+    # Own session per thread: the default boto3 session is not thread-safe
+    client = boto3.session.Session().client('lambda', region_name=region, config=_CLIENT_CONFIG)
+    
+    try:
+        response = client.publish_layer_version(
+            LayerName='twistlock-defender',
+            Description='Prisma Cloud Serverless Defender',
+            Content={'ZipFile': layer_content},
+            CompatibleRuntimes=COMPATIBLE_RUNTIMES,
+            LicenseInfo='Palo Alto Networks'
+        )
+        
+        layer_arn = response['LayerVersionArn']
+        version = response['Version']
+        print(f"   ✅ Success in {region}! ARN: {layer_arn} (v{version})")
+        
+    except Exception as e:
+        print(f"   ❌ Failed in {region}: {e}")
+
 def publish_to_aws(layer_content, regions):
     print("🚀 Starting AWS Layer Publication...")
     
-    for region in regions:
-        print(f"   --- Publishing to {region} ---")
-        client = boto3.client('lambda', region_name=region)
-        
-        try:
-            response = client.publish_layer_version(
-                LayerName='twistlock-defender',
-                Description='Prisma Cloud Serverless Defender',
-                Content={'ZipFile': layer_content},
-                CompatibleRuntimes=COMPATIBLE_RUNTIMES,
-                LicenseInfo='Palo Alto Networks'
-            )
-            
-            layer_arn = response['LayerVersionArn']
-            version = response['Version']
-            print(f"   ✅ Success! ARN: {layer_arn} (v{version})")
-            
-        except Exception as e:
-            print(f"   ❌ Failed in {region}: {e}")
+    # Uploads are independent per region, so run them side by side
+    with ThreadPoolExecutor(max_workers=len(regions)) as pool:
+        list(pool.map(lambda region: publish_to_region(layer_content, region), regions))
 
 def main():
     if not PRISMA_USER or not PRISMA_PASS:
@@ -3,7 +3,10 @@ import requests
 import json
 import os
 import zipfile
-import io
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 
 # ================= CONFIGURATION =================
 # ⚠️ UPDATE THIS URL to your actual Prisma Console (e.g., https://us-west1.cloud.twistlock.com/...)
@@ -23,6 +26,9 @@ DEFENDER_PAYLOAD = {
     "runtime": "python3.11" 
 }
 
+# Bundles larger than this are spooled to disk while downloading
+BUNDLE_SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
 # Runtimes to enable in AWS
 COMPATIBLE_RUNTIMES = [
     'python3.8', 'python3.9', 'python3.10', 'python3.11', 'python3.12', 
@@ -30,6 +36,9 @@ COMPATIBLE_RUNTIMES = [
 ]
 # =================================================
 
+# Adaptive retries back off when AWS throttles; keep-alive reuses connections
+_CLIENT_CONFIG = Config(retries={'max_attempts': 10, 'mode': 'adaptive'}, tcp_keepalive=True)
+
 def get_auth_token(access_key, secret_key):
     if not access_key or not secret_key:
         print("❌ Error: Missing Environment Variables.")
@@ -58,43 +67,57 @@ def download_defender_layer(token):
         resp = requests.post(url, headers=headers, json=DEFENDER_PAYLOAD, stream=True)
         resp.raise_for_status()
         
-        with zipfile.ZipFile(io.BytesIO(resp.content)) as bundle:
-            # Look for the specific layer zip file inside the bundle
-            for filename in bundle.namelist():
-                if "twistlock_defender_layer.zip" in filename:
-                    print("   ✅ Found 'twistlock_defender_layer.zip'")
-                    return bundle.read(filename)
-            
-            print("❌ Layer zip not found inside bundle.")
-            exit(1)
+        # Stream the bundle into a spooled temp file (spills to disk past the limit)
+        # instead of buffering the whole response in memory via resp.content
+        with tempfile.SpooledTemporaryFile(max_size=BUNDLE_SPOOL_MAX_BYTES) as tmp:
+            resp.raw.decode_content = True
+            shutil.copyfileobj(resp.raw, tmp)
+            tmp.seek(0)
+
+            with zipfile.ZipFile(tmp) as bundle:
+                # Look for the specific layer zip file inside the bundle
+                for filename in bundle.namelist():
+                    if "twistlock_defender_layer.zip" in filename:
+                        print("   ✅ Found 'twistlock_defender_layer.zip'")
+                        with bundle.open(filename) as layer_zip:
+                            return layer_zip.read()
+                
+                print("❌ Layer zip not found inside bundle.")
+                exit(1)
             
     except Exception as e:
         print(f"❌ Download Failed: {e}")
         exit(1)
 
+def publish_to_region(layer_content, region):
+    print(f"   --- Region: {region} ---")
+    # Ensure your local AWS credentials are set for this region
+    # Own session per thread: the default boto3 session is not thread-safe
+    client = boto3.session.Session().client('lambda', region_name=region, config=_CLIENT_CONFIG)
+    
+    try:
+        response = client.publish_layer_version(
+            LayerName='twistlock-defender',
+            Description='Prisma Cloud Serverless Defender (Universal)',
+            Content={'ZipFile': layer_content},
+            CompatibleRuntimes=COMPATIBLE_RUNTIMES,
+            LicenseInfo='Palo Alto Networks'
+        )
+        
+        layer_arn = response['LayerVersionArn']
+        print(f"   ✅ Published in {region}: {layer_arn}")
+        return layer_arn
+        
+    except Exception as e:
+        print(f"   ❌ Failed in {region}: {e}")
+
 def publish_to_aws(layer_content, regions):
+    """Publishes to all regions in parallel. Returns: dict of region -> layer ARN (None on failure)"""
     print("🚀 Publishing Layer to AWS...")
     
-    for region in regions:
-        print(f"   --- Region: {region} ---")
-        # Ensure your local AWS credentials are set for this region
-        client = boto3.client('lambda', region_name=region)
-        
-        try:
-            response = client.publish_layer_version(
-                LayerName='twistlock-defender',
-                Description='Prisma Cloud Serverless Defender (Universal)',
-                Content={'ZipFile': layer_content},
-                CompatibleRuntimes=COMPATIBLE_RUNTIMES,
-                LicenseInfo='Palo Alto Networks'
-            )
-            
-            layer_arn = response['LayerVersionArn']
-            print(f"   ✅ Published: {layer_arn}")
-            return layer_arn
-            
-        except Exception as e:
-            print(f"   ❌ Failed in {region}: {e}")
+    with ThreadPoolExecutor(max_workers=len(regions)) as pool:
+        arns = pool.map(lambda region: publish_to_region(layer_content, region), regions)
+        return dict(zip(regions, arns))
 
 def main():
     # 1. Authenticate
@@ -1,6 +1,19 @@
-import boto3
+import functools
+import json
 import logging
-from botocore.exceptions import ClientError
+import logging.handlers
+import os
+import queue
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# boto3/botocore are imported on first use (see _load_aws) to keep them out of the Lambda init phase.
+# Warm invocations reuse the loaded modules.
+boto3 = None
+Config = None
+BotoCoreError = None
+ClientError = None
 
 # =================CONFIGURATION=================
 
@@ -9,10 +22,24 @@ LAYER_ARNS = {
     'us-west-2': 'arn:aws:lambda:us-west-2:123456789012:layer:twistlock-defender:1',
 }
 
-SUPPORTED_RUNTIMES = [
+SUPPORTED_RUNTIMES = frozenset([
     'python3.8', 'python3.9', 'python3.10', 'python3.11', 'python3.12',
     'nodejs16.x', 'nodejs18.x', 'nodejs20.x'
-]
+])
+
+# Architectures the Defender layer has no build for
+_UNSUPPORTED_ARCH = frozenset({'arm64'})
+
+# The only ListFunctions fields the checks and update read; the rest is dropped before queueing
+_LISTED_KEYS = (
+    'FunctionName', 'FunctionArn', 'Runtime', 'MemorySize', 'Timeout', 'Layers',
+    'Environment', 'Architectures', 'PackageType', 'RevisionId'
+)
+
+# Layer ARNs that mean the Defender is already attached
+_PROTECTED_LAYER_RE = re.compile(r'twistlock|prisma')
+
+DEFENDER_WRAPPER = '/opt/twistlock/wrapper.sh'
 
 # --- SAFETY THRESHOLDS ---
 MAX_LAYERS = 5
@@ -20,7 +47,30 @@ MIN_MEMORY_MB = 256        # Defender agent needs overhead; 128MB is often too t
 TIMEOUT_BUFFER_SEC = 30    # If function timeout is > 870s, skip it. Defender adds latency.
 MAX_TIMEOUT_SEC = 900      # AWS Hard limit (15 mins)
 
-DRY_RUN = False            # Set True to audit without changes
+# Concurrent update_function_configuration calls per region (env-tunable for very large accounts)
+MAX_DEPLOY_WORKERS = int(os.environ.get('MAX_DEPLOY_WORKERS', '16'))
+# Covers MAX_DEPLOY_WORKERS so the shared client never waits for a socket
+MAX_POOL_CONNECTIONS = int(os.environ.get('MAX_POOL_CONNECTIONS', str(2 * MAX_DEPLOY_WORKERS)))
+# ListFunctions caps MaxItems at 50 per page (the service maximum), so the page count can't be cut further
+LIST_FUNCTIONS_PAGE_SIZE = 50
+# Polls (5s apart) for an in-progress update to finish before the single retry
+UPDATE_WAIT_ATTEMPTS = 12
+# Listed functions buffered ahead of the workers; bounds memory on very large accounts
+LIST_QUEUE_SIZE = 200
+_QUEUE_DONE = object()
+
+# Mirrors the IAM condition aws:ResourceTag/SecurityScan = "true" on UpdateFunctionConfiguration.
+# Untagged functions would be denied anyway, so skip them. Set REQUIRE_SCAN_TAG=false once the condition is dropped.
+SCAN_TAG_KEY = 'SecurityScan'
+
+# Set DRY_RUN=true (env var) to audit without changes
+_TRUTHY = ('1', 'true', 'yes')
+DRY_RUN = os.environ.get('DRY_RUN', 'false').lower() in _TRUTHY
+REQUIRE_SCAN_TAG = os.environ.get('REQUIRE_SCAN_TAG', 'true').lower() in _TRUTHY
+
+# S3 bucket holding protected/{region}.json (FunctionArn -> RevisionId) so re-runs skip known-protected functions.
+# Unset disables the cache.
+STATE_BUCKET = os.environ.get('STATE_BUCKET')
 
 # ===============================================
 
@@ -28,125 +78,352 @@ logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+class _TimedMemoryHandler(logging.handlers.MemoryHandler):
+    """MemoryHandler that also flushes once the oldest buffered record is flush_interval seconds old."""
+    def __init__(self, capacity, flush_interval, **kwargs):
+        super().__init__(capacity, **kwargs)
+        self.flush_interval = flush_interval
+
+    def shouldFlush(self, record):
+        return (super().shouldFlush(record) or
+                (self.buffer and record.created - self.buffer[0].created >= self.flush_interval))
+
+# Buffer per-function records and write them in batches; errors, a full buffer, or records older than
+# LOG_FLUSH_INTERVAL_SEC flush immediately, so a timed-out invocation still leaves its change log
+LOG_FLUSH_INTERVAL_SEC = 5
+_log_target = logger.handlers[0]
+_log_buffer = _TimedMemoryHandler(256, LOG_FLUSH_INTERVAL_SEC, flushLevel=logging.ERROR, target=_log_target)
+logger.removeHandler(_log_target)
+logger.addHandler(_log_buffer)
+
+def _load_aws():
+    global boto3, Config, BotoCoreError, ClientError
+    if boto3 is None:
+        from botocore.config import Config
+        from botocore.exceptions import BotoCoreError, ClientError
+        import boto3 as _boto3
+        boto3 = _boto3  # Set last: other threads treat it as "everything is loaded"
+
+@functools.lru_cache(maxsize=None)
 def get_lambda_client(region):
-    return boto3.client('lambda', region_name=region)
+    _load_aws()
+    # One client per region, built once and shared by its workers (keeps the connection pool warm).
+    # Own session per region: the default boto3 session is not safe to share across region threads
+    config = Config(
+        tcp_keepalive=True,                                # Keep connections warm across pages and updates
+        retries={'mode': 'adaptive', 'max_attempts': 10},  # Back off client-side when the fan-out gets throttled
+        max_pool_connections=MAX_POOL_CONNECTIONS
+    )
+    return boto3.session.Session().client('lambda', region_name=region, config=config)
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    _load_aws()
+    config = Config(tcp_keepalive=True, retries={'mode': 'adaptive', 'max_attempts': 10})
+    return boto3.session.Session().client('s3', config=config)
+
+def load_protected_cache(region):
+    """Returns the FunctionArn -> RevisionId map saved by the last run ({} if none)."""
+    if not STATE_BUCKET:
+        return {}
+    # The cache is only an optimisation: any failure (including a malformed object) means a full scan
+    try:
+        obj = get_s3_client().get_object(Bucket=STATE_BUCKET, Key=f"protected/{region}.json")
+        cached = json.loads(obj['Body'].read())
+        if not isinstance(cached, dict):
+            raise ValueError("expected a FunctionArn -> RevisionId object")
+        return cached
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            logger.warning(f"⚠️  Could not read protected cache for {region}, scanning everything: {e}")
+        return {}
+    except (BotoCoreError, ValueError) as e:
+        logger.warning(f"⚠️  Could not read protected cache for {region}, scanning everything: {e}")
+        return {}
+
+def save_protected_cache(region, protected):
+    try:
+        get_s3_client().put_object(
+            Bucket=STATE_BUCKET,
+            Key=f"protected/{region}.json",
+            Body=json.dumps(protected).encode('utf-8'),
+            ContentType='application/json'
+        )
+    except (ClientError, BotoCoreError, ValueError) as e:
+        logger.error(f"❌ Could not save protected cache for {region}: {e}")
 
 def is_protected(function_config):
     """Checks if Twistlock/Prisma layer or env vars are already present."""
     layers = function_config.get('Layers', [])
-    for layer in layers:
-        if 'twistlock' in layer['Arn'] or 'prisma' in layer['Arn']:
-            return True
-    
+    if any(_PROTECTED_LAYER_RE.search(layer['Arn']) for layer in layers):
+        return True
+
     env_vars = function_config.get('Environment', {}).get('Variables', {})
     if 'TW_POLICY' in env_vars:
         return True
+    if env_vars.get('AWS_LAMBDA_EXEC_WRAPPER') == DEFENDER_WRAPPER:
+        return True
     return False
 
 def assess_risk(function_config):
     """
     Performs deep inspection of hardware/software constraints.
-    Returns: (Boolean is_safe, String reason)
+    Returns: (Boolean is_safe, String reason, String category)
+    category is a stable key for the audit summary (e.g. 'LowMemory'); None when safe.
     """
     func_name = function_config['FunctionName']
     
     # 1. Package Type Check (CRITICAL)
     # Container Images cannot use Layers. They must embed defender in Dockerfile.
     if function_config.get('PackageType') == 'Image':
-        return False, "Skipping: Deployed as Container Image (Requires Dockerfile embedding)"
+        return False, "Skipping: Deployed as Container Image (Requires Dockerfile embedding)", 'ContainerImage'
 
     # 2. Architecture Check (CRITICAL)
     # Prisma Defender currently does not support ARM64 (Graviton).
-    architectures = function_config.get('Architectures', ['x86_64'])
-    if 'arm64' in architectures:
-        return False, "Skipping: ARM64 Architecture not supported by Defender Layer"
+    if _UNSUPPORTED_ARCH.intersection(function_config.get('Architectures') or ('x86_64',)):
+        return False, "Skipping: ARM64 Architecture not supported by Defender Layer", 'ARM64'
+
+    # 3. Layer Limit Check
+    # Cheap integer compare, so it runs before the runtime and threshold checks.
+    current_layers = function_config.get('Layers', ())
+    if len(current_layers) >= MAX_LAYERS:
+        return False, f"Skipping: Max Layers reached ({len(current_layers)}/{MAX_LAYERS})", 'MaxLayers'
 
-    # 3. Runtime Check
+    # 4. Runtime Check
     runtime = function_config.get('Runtime', '')
     if runtime not in SUPPORTED_RUNTIMES:
-        return False, f"Skipping: Unsupported Runtime ({runtime})"
-
-    # 4. Memory Headroom Check
-    # Defender adds ~50-100MB overhead depending on load. 128MB is risky.
-    memory = function_config.get('MemorySize', 128)
-    if memory < MIN_MEMORY_MB:
-        return False, f"Risk: Memory too low ({memory}MB). Minimum safe requires {MIN_MEMORY_MB}MB to avoid OOM."
+        return False, f"Skipping: Unsupported Runtime ({runtime})", 'Runtime'
 
     # 5. Timeout Buffer Check
     # Defender adds cold-start latency. If function is near 15min limit, we risk timing out.
     timeout = function_config.get('Timeout', 3)
     if timeout > (MAX_TIMEOUT_SEC - TIMEOUT_BUFFER_SEC):
-        return False, f"Risk: Timeout configured to {timeout}s. Too close to AWS limit ({MAX_TIMEOUT_SEC}s) to safely add overhead."
-
-    # 6. Layer Limit Check
-    current_layers = function_config.get('Layers', [])
-    if len(current_layers) >= MAX_LAYERS:
-        return False, f"Skipping: Max Layers reached ({len(current_layers)}/{MAX_LAYERS})"
-
-    return True, "Safe"
+        return False, f"Risk: Timeout configured to {timeout}s. Too close to AWS limit ({MAX_TIMEOUT_SEC}s) to safely add overhead.", 'Timeout'
 
-def deploy_defender(client, function_config, layer_arn):
+    # 6. Memory Headroom Check
+    # Defender adds ~50-100MB overhead depending on load. 128MB is risky.
+    memory = function_config.get('MemorySize', 128)
+    if memory < MIN_MEMORY_MB:
+        return False, f"Risk: Memory too low ({memory}MB). Minimum safe requires {MIN_MEMORY_MB}MB to avoid OOM.", 'LowMemory'
+
+    return True, "Safe", None
+
+def has_scan_tag(client, function_config):
+    """Checks the opt-in tag the IAM policy requires before an update is allowed. Lookup errors propagate."""
+    tags = client.list_tags(Resource=function_config['FunctionArn']).get('Tags', {})
+    return tags.get(SCAN_TAG_KEY, '').lower() == 'true'
+
+def protect_function(client, function_config, layer_arn, skips, protected):
+    if REQUIRE_SCAN_TAG:
+        try:
+            tagged = has_scan_tag(client, function_config)
+        except (ClientError, BotoCoreError) as e:
+            # Kept apart from MissingScanTag: e.g. a role without lambda:ListTags would otherwise look "untagged"
+            logger.error(f"❌ AWS Error reading tags on {function_config['FunctionName']}: {e}")
+            skips['TagLookupFailed'].append({'func': function_config['FunctionName'], 'reason': str(e)})
+            return
+        if not tagged:
+            skips['MissingScanTag'].append({
+                'func': function_config['FunctionName'],
+                'reason': f"Skipping: Missing {SCAN_TAG_KEY}=true tag"
+            })
+            return
+    revision_id = deploy_defender(client, function_config, layer_arn, skips)
+    if revision_id:
+        protected[function_config['FunctionArn']] = revision_id
+
+def deploy_defender(client, function_config, layer_arn, skips, retry_on_conflict=True):
+    """
+    Attaches the Defender using the ListFunctions payload as-is.
+    Only calls get_function_configuration when the update is rejected as stale or in-progress,
+    to re-read the function once and retry.
+    Returns the function's new RevisionId once protected, else None.
+    A function found unsafe on that re-read is recorded in skips (see scan_function).
+    """
+    assert 'RevisionId' in function_config, "deploy_defender expects the full function configuration"
     func_name = function_config['FunctionName']
-    current_layers = [l['Arn'] for l in function_config.get('Layers', [])]
-    
-    # Append Defender Layer
-    new_layers = current_layers + [layer_arn]
+    # Existing layers plus the Defender Layer, built in one list
+    new_layers = [l['Arn'] for l in function_config.get('Layers', ())]
+    new_layers.append(layer_arn)
     
-    # Merge Environment Variables
+    # Merge Environment Variables with the Prisma Specific Vars (one allocation, no copy-then-store)
     current_env = function_config.get('Environment', {}).get('Variables', {})
-    new_env = current_env.copy()
-    
-    # Prisma Specific Vars
-    new_env['TW_POLICY'] = func_name
-    new_env['AWS_LAMBDA_EXEC_WRAPPER'] = '/opt/twistlock/wrapper.sh'
+    new_env = {**current_env, 'TW_POLICY': func_name, 'AWS_LAMBDA_EXEC_WRAPPER': DEFENDER_WRAPPER}
 
     if DRY_RUN:
         logger.info(f"[DRY RUN] Would protect {func_name} (Memory: {function_config['MemorySize']}MB, Timeout: {function_config['Timeout']}s)")
-        return
+        return None
 
     try:
-        client.update_function_configuration(
+        response = client.update_function_configuration(
             FunctionName=func_name,
             Layers=new_layers,
-            Environment={'Variables': new_env}
+            Environment={'Variables': new_env},
+            RevisionId=function_config['RevisionId']  # Conditional write: fails fast if the function changed since listing
         )
         logger.info(f"✅ Protected: {func_name}")
+        return response['RevisionId']
     except ClientError as e:
-        logger.error(f"❌ AWS Error on {func_name}: {e}")
+        code = e.response['Error']['Code']
+        if code == 'PreconditionFailedException' and retry_on_conflict:
+            # 412: RevisionId is stale (changed since listing). Re-read once and retry against the fresh one
+            return retry_after_conflict(client, func_name, layer_arn, skips)
+        if code == 'ResourceConflictException' and retry_on_conflict:
+            # 409: another update is still in progress. Wait for it to finish, then re-read once and retry
+            return retry_after_conflict(client, func_name, layer_arn, skips, wait_for_update=True)
+        # Throttling already went through the client's adaptive retries; other errors won't clear on a retry
+        logger.error(f"❌ AWS Error on {func_name} ({code}): {e}")
+        return None
+
+def retry_after_conflict(client, func_name, layer_arn, skips, wait_for_update=False):
+    try:
+        if wait_for_update:
+            client.get_waiter('function_updated').wait(
+                FunctionName=func_name,
+                WaiterConfig={'Delay': 5, 'MaxAttempts': UPDATE_WAIT_ATTEMPTS}
+            )
+        fresh_config = client.get_function_configuration(FunctionName=func_name)
+    except (ClientError, BotoCoreError) as e:  # WaiterError is a BotoCoreError
+        logger.error(f"❌ AWS Error re-reading {func_name}: {e}")
+        return None
+
+    # The conflicting change may have protected the function, or made it unsafe
+    if is_protected(fresh_config):
+        return fresh_config['RevisionId']
+    is_safe, reason, category = assess_risk(fresh_config)
+    if not is_safe:
+        skips[category].append({'func': func_name, 'reason': reason})
+        return None
+    return deploy_defender(client, fresh_config, layer_arn, skips, retry_on_conflict=False)
+
+def scan_function(client, func, layer_arn, skips, protected):
+    """
+    Runs the protect pipeline for one listed function.
+    Unsafe functions are recorded in skips by category; protected ones in protected (FunctionArn -> RevisionId).
+    """
+    # Check if already protected
+    if is_protected(func):
+        protected[func['FunctionArn']] = func['RevisionId']
+        return
+
+    # Deep Risk Assessment
+    is_safe, reason, category = assess_risk(func)
+
+    if is_safe:
+        protect_function(client, func, layer_arn, skips, protected)
+    else:
+        skips[category].append({'func': func['FunctionName'], 'reason': reason})
+
+def _produce_functions(paginator, funcs, cached, protected):
+    try:
+        for page in paginator.paginate(PaginationConfig={'PageSize': LIST_FUNCTIONS_PAGE_SIZE}):
+            for func in page['Functions']:
+                # Unchanged since the last run protected it: nothing to check
+                if cached.get(func['FunctionArn']) == func['RevisionId']:
+                    protected[func['FunctionArn']] = func['RevisionId']
+                    continue
+                funcs.put({k: func[k] for k in _LISTED_KEYS if k in func})
+    finally:
+        # One sentinel per worker so every consumer exits, even if listing failed
+        for _ in range(MAX_DEPLOY_WORKERS):
+            funcs.put(_QUEUE_DONE)
+
+def _consume_functions(client, funcs, layer_arn, skips, protected):
+    while True:
+        func = funcs.get()
+        if func is _QUEUE_DONE:
+            return
+        try:
+            scan_function(client, func, layer_arn, skips, protected)
+        except Exception as e:
+            # Keep draining: a dead consumer would leave the producer blocked on a full queue
+            logger.error(f"❌ Failed on {func['FunctionName']}: {e}")
 
 def process_region(region):
-    if region not in LAYER_ARNS:
+    layer_arn = LAYER_ARNS.get(region)
+    if layer_arn is None:
         return
 
     logger.info(f"--- Scanning Region: {region} ---")
     client = get_lambda_client(region)
-    layer_arn = LAYER_ARNS[region]
     
     paginator = client.get_paginator('list_functions')
     
-    for page in paginator.paginate():
-        for func in page['Functions']:
-            func_name = func['FunctionName']
-            
-            # Check if already protected
-            if is_protected(func):
-                continue
-            
-            # Deep Risk Assessment
-            is_safe, reason = assess_risk(func)
-            
-            if is_safe:
-                deploy_defender(client, func, layer_arn)
-            else:
-                # Log failures as Warnings so we have an audit trail of UNPROTECTED functions
-                logger.warning(f"⚠️  Unprotected {func_name}: {reason}")
+    # Overlap listing with updates: one thread pages through functions while the workers protect them.
+    # The low-level client is thread-safe, so the workers share it (tag lookups run in the same pool)
+    funcs = queue.Queue(maxsize=LIST_QUEUE_SIZE)
+    skips = defaultdict(list)  # category -> [{'func', 'reason'}] left UNPROTECTED
+    cached = load_protected_cache(region)
+    protected = {}             # Rebuilt each run, so deleted functions drop out of the cache
+    with ThreadPoolExecutor(max_workers=MAX_DEPLOY_WORKERS + 1) as pool:
+        producer = pool.submit(_produce_functions, paginator, funcs, cached, protected)
+        for _ in range(MAX_DEPLOY_WORKERS):
+            pool.submit(_consume_functions, client, funcs, layer_arn, skips, protected)
+
+    # One PutObject per region, and only after a complete listing (a partial one would forget functions)
+    if STATE_BUCKET and producer.exception() is None and protected != cached:
+        save_protected_cache(region, protected)
+
+    # Audit trail of UNPROTECTED functions: one structured warning per region instead of one per function
+    if skips:
+        logger.warning(json.dumps({
+            'region': region,
+            'unprotected_counts': {category: len(entries) for category, entries in skips.items()},
+            'details': skips
+        }))
+    # Don't hold a finished region's change log until the end of the whole run
+    _log_buffer.flush()
+
+    # Surface listing errors so main() marks the region as failed
+    producer.result()
 
 def main():
-    for region in LAYER_ARNS.keys():
-        process_region(region)
+    # Regions are independent, so scan them in parallel
+    failed_regions = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(LAYER_ARNS)) as pool:
+            futures = {pool.submit(process_region, region): region for region in LAYER_ARNS}
+            for future in as_completed(futures):
+                region = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"❌ Scan failed in {region}: {e}")
+                    failed_regions.append(region)
+    finally:
+        # Write out whatever is still buffered before the run ends (or the Lambda freezes)
+        _log_buffer.flush()
+
+    # Let the other regions finish, then fail the run so the error is not lost
+    if failed_regions:
+        raise RuntimeError(f"Scan failed in regions: {', '.join(failed_regions)}")
 
 def lambda_handler(event, context):
-    main()
+    # Step Functions Map fan-out, so each region gets its own invocation (and 15 min budget):
+    #   {"list_regions": true}  -> {"regions": [...]} for the Map state to iterate
+    #   {"region": "us-east-1"} -> scan that region only
+    # Per-invocation override: {"dry_run": true|false}. Restored afterwards
+    # so a warm container falls back to the DRY_RUN env setting.
+    global DRY_RUN
+    event = event or {}
+    default_dry_run = DRY_RUN
+    if 'dry_run' in event:
+        DRY_RUN = str(event['dry_run']).lower() in _TRUTHY
+    try:
+        region = event.get('region')
+        if not region:
+            # Anything but the state machine's first step (e.g. a stale schedule aimed at this Lambda) protects nothing
+            if not event.get('list_regions'):
+                logger.warning("⚠️  Invoked without 'region': returning the region list only, no functions scanned. "
+                               "Schedule the Step Functions state machine, not this Lambda.")
+            return {'regions': list(LAYER_ARNS)}
+        if region not in LAYER_ARNS:
+            raise ValueError(f"No Defender layer configured for region {region}")
+        process_region(region)
+        return {'region': region}
+    finally:
+        DRY_RUN = default_dry_run
+        _log_buffer.flush()
 
 if __name__ == '__main__':
     main()
@@ -195,7 +472,8 @@ For Low Memory/Timeout: You must manually increase the Memory/Timeout settings i
             "Action": [
                 "lambda:ListFunctions",
                 "lambda:GetFunction",
-                "lambda:GetFunctionConfiguration"
+                "lambda:GetFunctionConfiguration",
+                "lambda:ListTags"
             ],
             "Resource": "*"
         },
@@ -214,6 +492,15 @@ For Low Memory/Timeout: You must manually increase the Memory/Timeout settings i
                 }
             }
         },
+        {
+            "Sid": "ProtectedCache",
+            "Effect": "Allow",
+            "Action": [
+                "s3:GetObject",
+                "s3:PutObject"
+            ],
+            "Resource": "arn:aws:s3:::YOUR-STATE-BUCKET/protected/*"
+        },
         {
             "Sid": "LoggingEssentials",
             "Effect": "Allow",
@@ -226,3 +513,49 @@ For Low Memory/Timeout: You must manually increase the Memory/Timeout settings i
         }
     ]
 }
+
+Running at scale (Step Functions fan-out)
+A single invocation scanning every region can hit the 15 minute Lambda limit on large accounts. Invoke the same function twice over: once with {"list_regions": true} to get the region list, then once per region through a Map state.
+
+{
+    "StartAt": "ListRegions",
+    "States": {
+        "ListRegions": {
+            "Type": "Task",
+            "Resource": "arn:aws:states:::lambda:invoke",
+            "Parameters": {
+                "FunctionName": "arn:aws:lambda:us-east-1:123456789012:function:prisma-auto-defender",
+                "Payload": { "list_regions": true }
+            },
+            "OutputPath": "$.Payload",
+            "Next": "ProtectRegions"
+        },
+        "ProtectRegions": {
+            "Type": "Map",
+            "ItemsPath": "$.regions",
+            "MaxConcurrency": 0,
+            "ItemSelector": {
+                "region.$": "$$.Map.Item.Value"
+            },
+            "ItemProcessor": {
+                "ProcessorConfig": { "Mode": "INLINE" },
+                "StartAt": "ProtectRegion",
+                "States": {
+                    "ProtectRegion": {
+                        "Type": "Task",
+                        "Resource": "arn:aws:states:::lambda:invoke",
+                        "Parameters": {
+                            "FunctionName": "arn:aws:lambda:us-east-1:123456789012:function:prisma-auto-defender",
+                            "Payload.$": "$"
+                        },
+                        "OutputPath": "$.Payload",
+                        "End": true
+                    }
+                }
+            },
+            "End": true
+        }
+    }
+}
+
+MaxConcurrency 0 runs every region at once. Point the EventBridge schedule at the state machine instead of the function; invoking the function directly without a region now only returns the region list (and logs a warning).